@@ -1,22 +1,57 @@
+import argparse
 import json
 import logging
 import os
 import re
 from time import time
+from typing import List
 
 import boto3
 from boto3.dynamodb.conditions import Attr
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from ses_forwarder.DedupeSQS import DedupeSQS
+from ses_forwarder.DynamoDBGuard import (
+    CircuitOpenError,
+    DeadlineExceededError,
+    DynamoDBGuard,
+)
 from ses_forwarder.LookupDestination import LookupDestination
+from ses_forwarder.RedriveDLQ import RedriveDLQ
 from ses_forwarder.S3Email import S3Email
-from ses_forwarder.utils import DedupeKey, LookupKey, Status
+from ses_forwarder.utils import (
+    DedupeKey,
+    LookupKey,
+    RedriveMode,
+    Status,
+    get_dedupe_id,
+)
 
-DedupeSQS = DedupeSQS(os.environ["DEDUPE_TABLE"], DedupeKey.HASH_KEY.value)
+GUARD_SETTINGS = {
+    "deadline": float(os.environ.get("DDB_DEADLINE", 2)),
+    "write_deadline": float(os.environ.get("DDB_WRITE_DEADLINE", 5)),
+    "hedge_percentile": float(os.environ.get("DDB_HEDGE_PERCENTILE", 95)),
+    "failure_threshold": int(os.environ.get("DDB_BREAKER_THRESHOLD", 5)),
+    "reset_timeout": float(os.environ.get("DDB_BREAKER_RESET", 30)),
+    "max_workers": int(os.environ.get("DDB_GUARD_WORKERS", 16)),
+}
+
+DedupeSQS = DedupeSQS(
+    os.environ["DEDUPE_TABLE"],
+    DedupeKey.HASH_KEY.value,
+    guard=DynamoDBGuard(**GUARD_SETTINGS),
+)
 LookupDestination = LookupDestination(
-    os.environ["LOOKUP_TABLE"], LookupKey.HASH_KEY.value, LookupKey.RANGE_KEY.value
+    os.environ["LOOKUP_TABLE"],
+    LookupKey.HASH_KEY.value,
+    LookupKey.RANGE_KEY.value,
+    guard=DynamoDBGuard(**GUARD_SETTINGS),
 )
-SQS_CLIENT = boto3.resource("sqs")
+# clients rather than resources, as they are shared by the redrive worker threads
+SQS_CLIENT = boto3.client("sqs")
+S3_CLIENT = boto3.client("s3")
+SES_CLIENT = boto3.client("ses", os.environ.get("REGION", "us-east-1"))
+
+COALESCE_SENDS = os.environ.get("COALESCE_SENDS", "false").lower() == "true"
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
@@ -54,12 +89,42 @@ def update_sqs_dynamodb(item: dict, status: Status):
     elif status == Status.COMPLETE:
         condition_expression = Attr(DedupeKey.STATUS.value).eq(Status.IN_PROGRESS.value)
 
+    # once the email is sent the COMPLETE write must not be skipped by an open
+    # breaker, and if it still fails the record is deleted rather than resent
     try:
-        DedupeSQS.update_item(item, condition_expression)
-    except ClientError as err:
+        DedupeSQS.update_item(
+            item, condition_expression, bypass_breaker=status == Status.COMPLETE
+        )
+    except (ClientError, BotoCoreError, CircuitOpenError, DeadlineExceededError) as err:
         if status == Status.IN_PROGRESS:
             raise ProcessingError(err)
 
+        LOGGER.error(f"Failed to mark item COMPLETE: {err}")
+
+
+def lookup_routes(orig_to: str) -> List[dict]:
+    """
+    Lookup the destination items for the given original recipient, falling back
+    to the catch all destination for its domain
+
+    Args:
+        orig_to (str): the address the email was originally sent to
+
+    Returns:
+        List[dict]: the lookup table items to forward the email to
+    """
+    orig_to = orig_to.split("@")
+
+    destinations = LookupDestination.lookup_destination(f"{orig_to[0]}#{orig_to[1]}")
+
+    # if destination(s) are already defined then use them
+    if destinations:
+        return destinations
+
+    # if destination(s) aren't defined, lookup the catch all destination
+    catch_all = LookupDestination.lookup_destination(f"*#{orig_to[1]}")
+    return catch_all[:1]
+
 
 def process_sns(message: dict):
     """
@@ -71,20 +136,10 @@ def process_sns(message: dict):
     bucket = message["receipt"]["action"]["bucketName"]
     key = message["receipt"]["action"]["objectKey"]
 
-    s3_email = S3Email(bucket, key)
-
-    orig_to = s3_email.orig_to.split("@")
+    s3_email = S3Email(bucket, key, s3_client=S3_CLIENT, ses_client=SES_CLIENT)
 
-    destinations = LookupDestination.lookup_destination(f"{orig_to[0]}#{orig_to[1]}")
-
-    # if destination(s) are already defined then add them to the email
-    if destinations:
-        for destination in destinations:
-            s3_email.add_forward_to(destination["destination"])
-    # if destination(s) aren't defined, lookup the catch all destination
-    else:
-        catch_all = LookupDestination.lookup_destination(f"*#{orig_to[1]}")
-        s3_email.add_forward_to(catch_all[0]["destination"])
+    for destination in lookup_routes(s3_email.orig_to):
+        s3_email.add_forward_to(destination["destination"])
 
     # send email
     response = s3_email.send_email()
@@ -92,6 +147,29 @@ def process_sns(message: dict):
     return response
 
 
+def check_send_quota(count: int):
+    """
+    Ensure the remaining SES daily quota can cover the given number of sends
+
+    Args:
+        count (int): the number of emails about to be sent
+
+    Raises:
+        ProcessingError: the remaining quota is too small
+    """
+    quota = SES_CLIENT.get_send_quota()
+
+    # accounts without a daily sending limit report a negative quota
+    if quota["Max24HourSend"] < 0:
+        return
+
+    remaining = quota["Max24HourSend"] - quota["SentLast24Hours"]
+    if remaining < count:
+        raise ProcessingError(
+            f"SES quota has {remaining} sends remaining but {count} are required"
+        )
+
+
 def delete_sqs(queue_arn: str, receipt_handle: str):
     """
     Delete record from the given sqs queue
@@ -102,64 +180,298 @@ def delete_sqs(queue_arn: str, receipt_handle: str):
     LOGGER.info(f"Deleting record {receipt_handle} from {queue_arn}")
     try:
         queue_name = queue_arn.split(":")[-1]
-        queue = SQS_CLIENT.get_queue_by_name(QueueName=queue_name)
-        message = SQS_CLIENT.Message(queue.url, receipt_handle)
-        message.delete()
+        queue_url = SQS_CLIENT.get_queue_url(QueueName=queue_name)["QueueUrl"]
+        SQS_CLIENT.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
     except Exception as err:
         LOGGER.error(err)
         raise err
 
 
-def main(event: dict):
+def claim_record(record: dict) -> dict:
+    """
+    Claim the given SQS record in the dedupe table before it is processed
+
+    Args:
+        record (dict): the SQS record consumed from the queue
+
+    Returns:
+        dict: the IN_PROGRESS DynamoDB item, or None if the record was already COMPLETE
+    """
+    message_id = get_dedupe_id(record)
+
+    item = DedupeSQS.get_item(message_id)
+
+    # check if sqs record has already been processed
+    if item and item[DedupeKey.STATUS.value] == Status.COMPLETE.value:
+        LOGGER.info(
+            f"Corresponding DynamoDB table item with message ID {message_id} marked COMPLETE."
+        )
+        delete_sqs(record["eventSourceARN"], record["receiptHandle"])
+        return None
+    elif item and item[DedupeKey.STATUS.value] == Status.IN_PROGRESS.value:
+        update_sqs_dynamodb(item, Status.IN_PROGRESS)
+    elif not item:
+        LOGGER.info(f"Creating a new DynamoDB item with message ID {message_id}")
+        item = DedupeSQS.create_item(message_id)
+
+    return item
+
+
+def complete_record(record: dict, item: dict, response: dict):
+    """
+    Mark the given SQS record COMPLETE and delete it from the queue once its
+    email has been sent
+
+    Args:
+        record (dict): the SQS record consumed from the queue
+        item (dict): the IN_PROGRESS DynamoDB item returned by claim_record
+        response (dict): the SES response for the sent email
+
+    Raises:
+        ProcessingError: SES did not accept the email
+    """
+    if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+        raise ProcessingError(
+            f"Sending email for message ID {get_dedupe_id(record)} returned {response['ResponseMetadata']['HTTPStatusCode']}"
+        )
+
+    # sqs record processing is complete
+    update_sqs_dynamodb(item, Status.COMPLETE)
+
+    # delete record from the queue
+    delete_sqs(record["eventSourceARN"], record["receiptHandle"])
+
+
+def process_record(record: dict) -> bool:
+    """
+    Process a single SQS record, honoring the dedupe table
+
+    Args:
+        record (dict): the SQS record consumed from the queue
+
+    Returns:
+        bool: True if an email was sent, False if the record was already COMPLETE
+    """
+    item = claim_record(record)
+    if not item:
+        return False
+
+    # process the sns message within the sqs record
+    message = json.loads(record["body"])
+    response = process_sns(json.loads(message["Message"]))
+
+    complete_record(record, item, response)
+
+    return True
+
+
+def coalesce_records(records: List[dict]) -> List[str]:
+    """
+    Process a batch of SQS records, grouping them by their resolved destinations.
+    Each original recipient is looked up once, each group shares the S3 and SES
+    clients, and the whole batch shares a single quota check. Groups whose
+    destinations opted in with the digest attribute are sent as one digest email.
+    A failing record or group does not stop the rest of the batch
+
+    Args:
+        records (List[dict]): the SQS records consumed from the queue
+
+    Returns:
+        List[str]: the message IDs of the records that failed
+    """
+    failures = []
+    routes = {}
+    groups = {}
+
+    for record in records:
+        try:
+            item = claim_record(record)
+            if not item:
+                continue
+
+            message = json.loads(json.loads(record["body"])["Message"])
+            s3_email = S3Email(
+                message["receipt"]["action"]["bucketName"],
+                message["receipt"]["action"]["objectKey"],
+                s3_client=S3_CLIENT,
+                ses_client=SES_CLIENT,
+            )
+
+            if s3_email.orig_to not in routes:
+                routes[s3_email.orig_to] = lookup_routes(s3_email.orig_to)
+
+            destinations = routes[s3_email.orig_to]
+            for destination in destinations:
+                s3_email.add_forward_to(destination["destination"])
+        except Exception as err:
+            LOGGER.error(f"Failed to process message ID {record['messageId']}: {err}")
+            failures.append(record["messageId"])
+            continue
+
+        digest = any(
+            destination.get(LookupKey.DIGEST.value) for destination in destinations
+        )
+        group = groups.setdefault((tuple(sorted(s3_email.forward_to)), digest), [])
+        group.append((record, item, s3_email))
+
+    # a single quota check covers every send in the batch
+    sends = sum(
+        1 if digest and len(group) > 1 else len(group)
+        for (_, digest), group in groups.items()
+    )
+    try:
+        if sends:
+            check_send_quota(sends)
+    except Exception as err:
+        LOGGER.error(f"Failed to send coalesced emails: {err}")
+        for group in groups.values():
+            failures.extend(record["messageId"] for record, _, _ in group)
+
+        return failures
+
+    for (forward_to, digest), group in groups.items():
+        LOGGER.info(f"Sending {len(group)} coalesced emails to {list(forward_to)}")
+        digest = digest and len(group) > 1
+
+        try:
+            if digest:
+                response = S3Email.send_digest([s3_email for _, _, s3_email in group])
+        except Exception as err:
+            LOGGER.error(
+                f"Failed to send coalesced emails to {list(forward_to)}: {err}"
+            )
+            failures.extend(record["messageId"] for record, _, _ in group)
+            continue
+
+        for record, item, s3_email in group:
+            try:
+                complete_record(
+                    record, item, response if digest else s3_email.send_email()
+                )
+            except Exception as err:
+                LOGGER.error(
+                    f"Failed to process message ID {record['messageId']}: {err}"
+                )
+                failures.append(record["messageId"])
+
+    return failures
+
+
+def main(event: dict) -> dict:
     """
     Lambda entry point method processing messages consumed from SQS
 
     Args:
         event (dict): the event consumed from SQS
         context ([type]): the context of the event trigger
+
+    Returns:
+        dict: the records that failed, so only they are returned to the queue
     """
     LOGGER.debug(f"Event received {json.dumps(event)}")
 
-    for record in event["Records"]:
-        message_id = record["messageId"]
-        sqs_arn = record["eventSourceARN"]
-        receipt_handle = record["receiptHandle"]
+    failures = []
+    try:
+        if COALESCE_SENDS and len(event["Records"]) > 1:
+            failures = coalesce_records(event["Records"])
+        else:
+            for record in event["Records"]:
+                try:
+                    process_record(record)
+                except Exception as err:
+                    LOGGER.error(
+                        f"Failed to process message ID {record['messageId']}: {err}"
+                    )
+                    failures.append(record["messageId"])
+    finally:
+        LOGGER.info(
+            f"DynamoDB guard counters dedupe={DedupeSQS.guard.metrics()} lookup={LookupDestination.guard.metrics()}"
+        )
+
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]
+    }
 
-        item = DedupeSQS.get_item(message_id)
 
-        # check if sqs record has already been processed
-        if item and item[DedupeKey.STATUS.value] == Status.COMPLETE.value:
-            LOGGER.info(
-                f"Corresponding DynamoDB table item with message ID {message_id} marked COMPLETE."
-            )
-            delete_sqs(sqs_arn, receipt_handle)
-            continue
-        elif item and item[DedupeKey.STATUS.value] == Status.IN_PROGRESS.value:
-            update_sqs_dynamodb(item, Status.IN_PROGRESS)
-        elif not item:
-            LOGGER.info(f"Creating a new DynamoDB item with message ID {message_id}")
-            item = DedupeSQS.create_item(message_id)
+def handler(event: dict, context):
+    return main(event)
 
-        # process the sns message within the sqs record
-        message = json.loads(record["body"])
-        response = process_sns(json.loads(message["Message"]))
 
-        if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
-            # sqs record processing is complete
-            update_sqs_dynamodb(item, Status.COMPLETE)
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Debug single emails or redrive the dead letter queue"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    debug = subparsers.add_parser("debug", help="forward a single email from S3")
+    debug.add_argument("--bucket", required=True, help="bucket holding the email")
+    debug.add_argument("--key", required=True, help="object key of the email")
+
+    redrive = subparsers.add_parser("redrive", help="drain the dead letter queue")
+    redrive.add_argument("--dlq", required=True, help="name of the dead letter queue")
+    redrive.add_argument(
+        "--mode",
+        choices=[mode.value for mode in RedriveMode],
+        default=RedriveMode.PROCESS.value,
+        help="send the emails directly or move the messages back to --queue",
+    )
+    redrive.add_argument("--queue", help="name of the main queue (move mode only)")
+    redrive.add_argument("--workers", type=int, default=8)
+    redrive.add_argument(
+        "--rate", type=float, default=10, help="maximum messages per second"
+    )
+    redrive.add_argument(
+        "--ses-share",
+        type=float,
+        default=0.5,
+        help="fraction of the SES send rate and remaining daily quota to use",
+    )
+    redrive.add_argument("--max-messages", type=int, help="stop after this many")
+    redrive.add_argument(
+        "--visibility-timeout",
+        type=int,
+        default=60,
+        help="seconds a received message stays hidden while it waits to be handled",
+    )
 
-            # delete record from the queue
-            delete_sqs(sqs_arn, receipt_handle)
+    args = parser.parse_args(argv)
+    if args.command == "redrive":
+        if args.mode == RedriveMode.MOVE.value and not args.queue:
+            parser.error("--queue is required when --mode is move")
 
+        for name in ("workers", "rate", "ses_share"):
+            if getattr(args, name) <= 0:
+                parser.error(f"--{name.replace('_', '-')} must be positive")
 
-def handler(event: dict, context):
-    main(event)
+    return args
 
 
 if __name__ == "__main__":
-    # quick mechanism to debug broken emails
-    sns_message = {
-        "receipt": {"action": {"bucketName": "[bucket]", "objectKey": "[key]"}}
-    }
+    args = parse_args()
+
+    if args.command == "debug":
+        # quick mechanism to debug broken emails
+        sns_message = {
+            "receipt": {"action": {"bucketName": args.bucket, "objectKey": args.key}}
+        }
 
-    process_sns(sns_message)
+        process_sns(sns_message)
+    else:
+        # every redrive worker reads through the shared guards
+        DedupeSQS.guard.size_for(args.workers)
+        LookupDestination.guard.size_for(args.workers)
+
+        redrive = RedriveDLQ(
+            args.dlq,
+            process_record,
+            DedupeSQS,
+            mode=RedriveMode(args.mode),
+            queue_name=args.queue,
+            max_workers=args.workers,
+            max_rate=args.rate,
+            ses_share=args.ses_share,
+            visibility_timeout=args.visibility_timeout,
+            region=os.environ.get("REGION", "us-east-1"),
+        )
+
+        print(json.dumps(redrive.run(args.max_messages), indent=2))
@@ -1,10 +1,10 @@
 import logging
 from time import time
 
-from boto3 import resource
 from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
+from .DynamoDBGuard import DynamoDBGuard
 from .utils import DedupeKey, Status
 
 LOGGER = logging.getLogger()
@@ -13,15 +13,18 @@ LOGGER.setLevel(logging.INFO)
 
 
 class DedupeSQS:
-    def __init__(self, table_name: str, hash_key: str):
+    def __init__(self, table_name: str, hash_key: str, guard: DynamoDBGuard = None):
         LOGGER.info(
             f"Setting up DynamoDB resource for table '{table_name}' with hash key '{hash_key}'"
         )
-        dynamodb = resource("dynamodb")
+        self.guard = guard or DynamoDBGuard()
+        self.table_name = table_name
 
         try:
             self.hash_key = hash_key
-            self.table = dynamodb.Table(name=table_name)
+            # build both clients up front so no read pays for it inside the deadline
+            self.guard.client()
+            self.guard.client(write=True)
         except ClientError as err:
             LOGGER.error(err)
             raise err
@@ -41,11 +44,15 @@ class DedupeSQS:
 
     def get_item(self, partition_key_value: str) -> dict:
         LOGGER.info(
-            f"Querying table '{self.table.table_name}' for item with hash value '{partition_key_value}'"
+            f"Querying table '{self.table_name}' for item with hash value '{partition_key_value}'"
         )
         try:
-            response = self.table.get_item(
-                Key={self.hash_key: partition_key_value}, ConsistentRead=True
+            response = self.guard.read(
+                lambda: self.guard.client().get_item(
+                    TableName=self.table_name,
+                    Key={self.hash_key: partition_key_value},
+                    ConsistentRead=True,
+                )
             )
 
             if DedupeKey.ITEM.value in response:
@@ -54,15 +61,25 @@ class DedupeSQS:
             LOGGER.error(err)
             raise err
 
-    def update_item(self, item: dict, condition_expression: Attr = None) -> dict:
+    def update_item(
+        self,
+        item: dict,
+        condition_expression: Attr = None,
+        bypass_breaker: bool = False,
+    ) -> dict:
         try:
             hash_value = item[self.hash_key]
 
             LOGGER.info(
-                f"Putting item with hash value '{hash_value}' into table '{self.table}'"
+                f"Putting item with hash value '{hash_value}' into table '{self.table_name}'"
             )
-            return self.table.put_item(
-                Item=item, ConditionExpression=condition_expression
+            kwargs = {"TableName": self.table_name, "Item": item}
+            if condition_expression is not None:
+                kwargs["ConditionExpression"] = condition_expression
+
+            return self.guard.write(
+                lambda: self.guard.client(write=True).put_item(**kwargs),
+                bypass_breaker=bypass_breaker,
             )
         except (ClientError, KeyError) as err:
             LOGGER.error(err)
@@ -0,0 +1,292 @@
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+from typing import Callable
+
+from boto3 import resource
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .utils import GuardCounter
+
+LOGGER = logging.getLogger()
+
+LOGGER.setLevel(logging.INFO)
+
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+}
+
+# attempts per write, including the first, before the error reaches the breaker
+WRITE_ATTEMPTS = 3
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class DynamoDBGuard:
+    """
+    Resilience layer for the DynamoDB data-access classes. Reads are bounded by a
+    deadline and hedged with a duplicate request once they run longer than the given
+    percentile of recent latencies. Repeated throttling or missed deadlines open a
+    circuit breaker so callers fail fast, or fall back to cached data, until the
+    table has had time to recover
+
+    Attrs:
+        deadline (float): seconds a read may take before DeadlineExceededError is raised
+        write_deadline (float): seconds a write, including its retries, may take before
+            DeadlineExceededError is raised
+        hedge_percentile (float): latency percentile after which a hedged read is sent
+        failure_threshold (int): consecutive transient failures that open the breaker
+        reset_timeout (float): seconds the breaker stays open before a trial call
+        counters (Counter): the number of times each GuardCounter occurred
+    """
+
+    def __init__(
+        self,
+        deadline: float = 2.0,
+        write_deadline: float = 5.0,
+        hedge_percentile: float = 95,
+        hedge_delay: float = 0.1,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        max_workers: int = 16,
+        sample_size: int = 100,
+    ):
+        self.deadline = deadline
+        self.write_deadline = write_deadline
+        self.hedge_percentile = hedge_percentile
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.counters = Counter()
+
+        self._hedge_delay = hedge_delay
+        self._latencies = deque(maxlen=sample_size)
+        self._max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._failures = 0
+        self._opened_at = None
+
+    def config(self, write: bool = False) -> Config:
+        """
+        Return the botocore config for reads or writes. Both bound each attempt by
+        the deadline. Reads make a single attempt, so throttling reaches the breaker
+        instead of hiding in botocore's backoff and firing hedges. Writes are never
+        hedged, so they get a few retries to ride out brief throttling, bounded
+        overall by the write deadline
+
+        Args:
+            write (bool): whether the config is for writes
+        """
+        return Config(
+            connect_timeout=self.deadline,
+            read_timeout=self.deadline,
+            retries={
+                "max_attempts": WRITE_ATTEMPTS if write else 1,
+                "mode": "standard",
+            },
+        )
+
+    def client(self, write: bool = False):
+        """
+        Return the DynamoDB client for reads or writes. boto3 resources are not
+        thread-safe but their clients are, so every thread shares one client built
+        on first use. The resource's client keeps its handlers for Python types and
+        condition expressions
+
+        Args:
+            write (bool): whether the client is used for writes
+        """
+        with self._lock:
+            if write not in self._clients:
+                dynamodb = resource("dynamodb", config=self.config(write))
+                self._clients[write] = dynamodb.meta.client
+
+            return self._clients[write]
+
+    def size_for(self, callers: int):
+        """
+        Grow the read pool for the given number of concurrent callers. Each caller
+        may hold a primary and a hedged read, and both can outlive the deadline
+        until their own timeouts expire
+
+        Args:
+            callers (int): the number of threads reading through this guard
+        """
+        max_workers = 4 * callers
+        with self._lock:
+            if max_workers <= self._max_workers:
+                return
+
+            self._max_workers = max_workers
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def is_transient(err: Exception) -> bool:
+        if isinstance(err, (CircuitOpenError, DeadlineExceededError)):
+            return True
+
+        return (
+            isinstance(err, ClientError)
+            and err.response["Error"]["Code"] in THROTTLING_ERRORS
+        )
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        # not enough samples yet to estimate the percentile
+        if len(latencies) < 10:
+            return self._hedge_delay
+
+        index = min(
+            len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100)
+        )
+        return latencies[index]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                counter.value: self.counters[counter.value] for counter in GuardCounter
+            }
+
+    def count(self, counter: GuardCounter):
+        with self._lock:
+            self.counters[counter.value] += 1
+
+    def _allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+
+            # let a trial call through once the breaker has cooled down
+            if monotonic() - self._opened_at >= self.reset_timeout:
+                self._opened_at = monotonic()
+                return
+
+        raise CircuitOpenError("DynamoDB circuit breaker is open")
+
+    def _record(self, err: Exception = None):
+        with self._lock:
+            if err is None or not self.is_transient(err):
+                self._failures = 0
+                self._opened_at = None
+                return
+
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                LOGGER.warning(
+                    f"Opening DynamoDB circuit breaker after {self._failures} failures"
+                )
+                self._opened_at = monotonic()
+                self.counters[GuardCounter.BREAKER_TRIPS.value] += 1
+
+    def _timed(self, call: Callable[[], dict]) -> dict:
+        started = monotonic()
+        response = call()
+
+        with self._lock:
+            self._latencies.append(monotonic() - started)
+
+        return response
+
+    def read(self, call: Callable[[], dict]) -> dict:
+        """
+        Run an idempotent read, sending a hedged duplicate if it is slow. Hedging is
+        skipped while failures are accumulating, as a struggling table would only
+        be sent more requests
+
+        Args:
+            call (Callable): the table read to invoke
+
+        Raises:
+            CircuitOpenError: the breaker is open
+            DeadlineExceededError: no response arrived within the deadline
+        """
+        self._allow()
+
+        with self._lock:
+            executor = self._executor
+            hedge = self._failures == 0
+
+        started = monotonic()
+        futures = {executor.submit(self._timed, call)}
+
+        done, _ = wait(futures, timeout=self.hedge_delay() if hedge else 0)
+        if not done and hedge:
+            self.count(GuardCounter.HEDGES_FIRED)
+            futures.add(executor.submit(self._timed, call))
+
+        error = None
+        while futures:
+            remaining = self.deadline - (monotonic() - started)
+            done, futures = wait(
+                futures, timeout=max(0, remaining), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                break
+
+            for future in done:
+                if future.exception() is None:
+                    self._record()
+                    return future.result()
+
+                error = error or future.exception()
+
+        if error is None:
+            self.count(GuardCounter.DEADLINES_EXCEEDED)
+            error = DeadlineExceededError(
+                f"DynamoDB read did not complete within {self.deadline} seconds"
+            )
+
+        self._record(error)
+        raise error
+
+    def write(self, call: Callable[[], dict], bypass_breaker: bool = False) -> dict:
+        """
+        Run a write through the breaker. Writes are never hedged as the tables use
+        conditional puts, so they rely on the retries of the config, bounded by the
+        write deadline
+
+        Args:
+            call (Callable): the table write to invoke
+            bypass_breaker (bool): attempt the write even while the breaker is open,
+                for writes that must not be dropped
+
+        Raises:
+            CircuitOpenError: the breaker is open
+            DeadlineExceededError: the write did not complete within the write deadline
+        """
+        if not bypass_breaker:
+            self._allow()
+
+        with self._lock:
+            executor = self._executor
+
+        future = executor.submit(call)
+        done, _ = wait({future}, timeout=self.write_deadline)
+        if not done:
+            self.count(GuardCounter.DEADLINES_EXCEEDED)
+            error = DeadlineExceededError(
+                f"DynamoDB write did not complete within {self.write_deadline} seconds"
+            )
+            self._record(error)
+            raise error
+
+        if future.exception() is not None:
+            self._record(future.exception())
+            raise future.exception()
+
+        self._record()
+        return future.result()
@@ -1,12 +1,14 @@
 import logging
-from time import time
+import threading
+from collections import OrderedDict
+from time import monotonic, time
 from typing import List
 
-from boto3 import resource
 from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
-from .utils import LookupKey, Status
+from .DynamoDBGuard import DynamoDBGuard
+from .utils import GuardCounter, LookupKey, Status
 
 LOGGER = logging.getLogger()
 
@@ -14,44 +16,99 @@ LOGGER.setLevel(logging.INFO)
 
 
 class LookupDestination:
-    def __init__(self, table_name: str, hash_key: str, range_key: str):
+    def __init__(
+        self,
+        table_name: str,
+        hash_key: str,
+        range_key: str,
+        guard: DynamoDBGuard = None,
+        cache_size: int = 1024,
+        cache_ttl: float = 300,
+    ):
         LOGGER.info(
             f"Setting up DynamoDB resource for table '{table_name}' with hash key '{hash_key}' and range key '{range_key}'"
         )
-        dynamodb = resource("dynamodb")
+        self.guard = guard or DynamoDBGuard()
+        self.table_name = table_name
+
+        # last known routes, served while the table is throttling. The cache is an
+        # LRU with a maximum age, so lookups for random addresses can't grow it
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._routes = OrderedDict()
+        self._routes_lock = threading.Lock()
 
         try:
             self.hash_key = hash_key
             self.range_key = range_key
-            self.table = dynamodb.Table(name=table_name)
+            # build both clients up front so no read pays for it inside the deadline
+            self.guard.client()
+            self.guard.client(write=True)
         except ClientError as err:
             LOGGER.error(err)
             raise err
 
+    def _cached_route(self, partition_key_value: str) -> list:
+        # return the cached route, or None if it is missing or too old to serve
+        with self._routes_lock:
+            if partition_key_value not in self._routes:
+                return None
+
+            cached_at, items = self._routes[partition_key_value]
+            if monotonic() - cached_at > self.cache_ttl:
+                del self._routes[partition_key_value]
+                return None
+
+            self._routes.move_to_end(partition_key_value)
+            return items
+
+    def _cache_route(self, partition_key_value: str, items: list):
+        with self._routes_lock:
+            self._routes[partition_key_value] = (monotonic(), items)
+            self._routes.move_to_end(partition_key_value)
+            while len(self._routes) > self.cache_size:
+                self._routes.popitem(last=False)
+
     def lookup_destination(self, partition_key_value: str) -> dict:
         LOGGER.info(
-            f"Querying table '{self.table.table_name}' for item with hash value '{partition_key_value}'"
+            f"Querying table '{self.table_name}' for item with hash value '{partition_key_value}'"
         )
         try:
-            response = self.table.query(
-                KeyConditionExpression=Key(self.hash_key).eq(partition_key_value),
-                ConsistentRead=True,
+            response = self.guard.read(
+                lambda: self.guard.client().query(
+                    TableName=self.table_name,
+                    KeyConditionExpression=Key(self.hash_key).eq(partition_key_value),
+                    ConsistentRead=True,
+                )
             )
+        except Exception as err:
+            items = None
+            if self.guard.is_transient(err):
+                items = self._cached_route(partition_key_value)
+
+            if items is not None:
+                LOGGER.warning(
+                    f"Falling back to cached route for '{partition_key_value}': {err}"
+                )
+                self.guard.count(GuardCounter.FALLBACKS)
+                return items
 
-            if LookupKey.ITEMS.value in response:
-                return response[LookupKey.ITEMS.value]
-        except ClientError as err:
             LOGGER.error(err)
             raise err
 
+        items = response.get(LookupKey.ITEMS.value)
+        self._cache_route(partition_key_value, items)
+        return items
+
     def add_destination(self, item: dict) -> dict:
         try:
             hash_value = item[self.hash_key]
 
             LOGGER.info(
-                f"Putting item with hash value '{hash_value}' into table '{self.table}'"
+                f"Putting item with hash value '{hash_value}' into table '{self.table_name}'"
             )
-            response = self.table.put_item(
+            response = self.guard.client(write=True).put_item(
+                TableName=self.table_name,
                 Item=item,
                 ReturnValues="ALL_OLD",
             )
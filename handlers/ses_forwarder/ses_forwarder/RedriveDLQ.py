@@ -0,0 +1,336 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Callable
+
+from boto3 import client
+from botocore.exceptions import ClientError
+
+from .DedupeSQS import DedupeSQS
+from .utils import (
+    DedupeKey,
+    RedriveKey,
+    RedriveMode,
+    RedriveOutcome,
+    Status,
+    get_dedupe_id,
+)
+
+LOGGER = logging.getLogger()
+
+LOGGER.setLevel(logging.INFO)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket shared by the redrive workers
+
+    Attrs:
+        rate (float): tokens added per second
+        capacity (float): maximum number of tokens held at once
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            sleep(wait)
+
+
+class RedriveDLQ:
+    """
+    Drains the dead letter queue in parallel, either by processing the messages
+    directly or by moving them back onto the main queue. Throughput is capped by
+    the requested messages per second and by a share of the SES send quota so that
+    live traffic keeps its headroom
+
+    Attrs:
+        mode (RedriveMode): whether to process or move the messages
+        max_workers (int): number of threads receiving from the dead letter queue
+        rate (float): the effective messages per second after applying the SES quota
+        budget (int): the number of messages allowed by the remaining SES daily quota,
+            or None when the account has no daily limit
+        batch_size (int): messages each worker receives at once, sized so that a batch
+            is handled well within the visibility timeout
+    """
+
+    def __init__(
+        self,
+        dlq_name: str,
+        process_record: Callable[[dict], bool],
+        dedupe: DedupeSQS,
+        mode: RedriveMode = RedriveMode.PROCESS,
+        queue_name: str = None,
+        max_workers: int = 8,
+        max_rate: float = 10,
+        ses_share: float = 0.5,
+        visibility_timeout: int = 60,
+        region: str = "us-east-1",
+    ):
+        if mode == RedriveMode.MOVE and not queue_name:
+            raise ValueError("queue_name is required to move messages")
+
+        self.sqs_client = client("sqs", region)
+        self.ses_client = client("ses", region)
+
+        self.mode = mode
+        self.max_workers = max_workers
+        self.visibility_timeout = visibility_timeout
+        self.process_record = process_record
+        self.dedupe = dedupe
+
+        try:
+            self.dlq_url = self.sqs_client.get_queue_url(QueueName=dlq_name)["QueueUrl"]
+            self.dlq_arn = self.sqs_client.get_queue_attributes(
+                QueueUrl=self.dlq_url, AttributeNames=["QueueArn"]
+            )["Attributes"]["QueueArn"]
+            self.queue_url = None
+            if queue_name:
+                self.queue_url = self.sqs_client.get_queue_url(QueueName=queue_name)[
+                    "QueueUrl"
+                ]
+
+            quota = self.ses_client.get_send_quota()
+        except ClientError as err:
+            LOGGER.error(err)
+            raise err
+
+        self.rate = min(max_rate, quota["MaxSendRate"] * ses_share)
+        self.budget = None
+        # accounts without a daily sending limit report a negative quota
+        if quota["Max24HourSend"] >= 0:
+            self.budget = int(
+                (quota["Max24HourSend"] - quota["SentLast24Hours"]) * ses_share
+            )
+
+        # keep the rate limited work a worker holds to half the visibility timeout
+        self.batch_size = max(
+            1, min(10, int(self.rate * visibility_timeout / (2 * max_workers)))
+        )
+        LOGGER.info(
+            f"Redriving '{dlq_name}' in {mode.value} mode at {self.rate} messages per second "
+            f"with a budget of {self.budget} messages and batches of {self.batch_size}"
+        )
+
+        self._limiter = RateLimiter(self.rate)
+        self._lock = threading.Lock()
+        self._summary = Counter()
+        self._claimed = 0
+        self._limit = None
+        self._failed = set()
+
+    def _exhausted(self) -> bool:
+        if self.budget is not None and self._claimed >= self.budget:
+            return True
+
+        return self._limit is not None and self._claimed >= self._limit
+
+    def _claim(self) -> bool:
+        # reserve one message against the SES budget and the optional limit
+        with self._lock:
+            if self._exhausted():
+                return False
+
+            self._claimed += 1
+            return True
+
+    def _record(self, outcome: RedriveOutcome):
+        with self._lock:
+            self._summary[outcome.value] += 1
+
+    def _fail(self, message: dict, err: Exception):
+        # failed messages stay hidden until the visibility timeout, so a message
+        # received again later in the drain is only counted once
+        LOGGER.error(f"Failed to redrive message {message['MessageId']}: {err}")
+        with self._lock:
+            self._failed.add(message["MessageId"])
+            self._summary[RedriveOutcome.FAILED.value] += 1
+
+    def _has_failed(self, message: dict) -> bool:
+        with self._lock:
+            return message["MessageId"] in self._failed
+
+    def _to_record(self, message: dict) -> dict:
+        # shape a ReceiveMessage response like the record Lambda receives from SQS
+        attributes = {
+            name: {"stringValue": value["StringValue"], "dataType": value["DataType"]}
+            for name, value in message.get("MessageAttributes", {}).items()
+        }
+
+        return {
+            "messageId": message["MessageId"],
+            "receiptHandle": message["ReceiptHandle"],
+            "body": message["Body"],
+            "messageAttributes": attributes,
+            "eventSourceARN": self.dlq_arn,
+        }
+
+    def _is_complete(self, message: dict) -> bool:
+        item = self.dedupe.get_item(get_dedupe_id(self._to_record(message)))
+        return bool(item) and item[DedupeKey.STATUS.value] == Status.COMPLETE.value
+
+    def _delete(self, message: dict):
+        self.sqs_client.delete_message(
+            QueueUrl=self.dlq_url, ReceiptHandle=message["ReceiptHandle"]
+        )
+
+    def _move(self, message: dict):
+        # carry the original message ID so the dedupe table item is reused
+        attributes = message.get("MessageAttributes", {})
+        attributes[RedriveKey.ORIGINAL_MESSAGE_ID.value] = {
+            "StringValue": get_dedupe_id(self._to_record(message)),
+            "DataType": "String",
+        }
+
+        self.sqs_client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=message["Body"],
+            MessageAttributes=attributes,
+        )
+        self._delete(message)
+
+    def _release(self, message: dict):
+        # make an unhandled message immediately visible again
+        try:
+            self.sqs_client.change_message_visibility(
+                QueueUrl=self.dlq_url,
+                ReceiptHandle=message["ReceiptHandle"],
+                VisibilityTimeout=0,
+            )
+        except ClientError as err:
+            LOGGER.error(err)
+
+    def _extend(self, message: dict, received: float) -> bool:
+        # keep a message hidden while it waits on the rate limiter
+        if monotonic() - received < self.visibility_timeout / 2:
+            return True
+
+        try:
+            self.sqs_client.change_message_visibility(
+                QueueUrl=self.dlq_url,
+                ReceiptHandle=message["ReceiptHandle"],
+                VisibilityTimeout=self.visibility_timeout,
+            )
+        except ClientError as err:
+            LOGGER.error(f"Failed to extend message {message['MessageId']}: {err}")
+            return False
+
+        return True
+
+    def _handle(self, message: dict, received: float):
+        # a message that already failed is left in the dead letter queue for a later run
+        if self._has_failed(message):
+            return
+
+        # messages already forwarded are dropped without spending any SES budget
+        try:
+            if self._is_complete(message):
+                self._delete(message)
+                self._record(RedriveOutcome.SKIPPED)
+                return
+        except Exception as err:
+            self._fail(message, err)
+            return
+
+        if not self._claim():
+            self._release(message)
+            self._record(RedriveOutcome.DEFERRED)
+            return
+
+        self._limiter.acquire()
+
+        # the receipt handle expired, so the message is left for another receive
+        if not self._extend(message, received):
+            self._record(RedriveOutcome.DEFERRED)
+            return
+
+        try:
+            if self.mode == RedriveMode.MOVE:
+                self._move(message)
+                self._record(RedriveOutcome.MOVED)
+            elif self.process_record(self._to_record(message)):
+                self._record(RedriveOutcome.SENT)
+            else:
+                self._record(RedriveOutcome.SKIPPED)
+        except Exception as err:
+            self._fail(message, err)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if self._exhausted():
+                    return
+
+            response = self.sqs_client.receive_message(
+                QueueUrl=self.dlq_url,
+                MaxNumberOfMessages=self.batch_size,
+                WaitTimeSeconds=1,
+                VisibilityTimeout=self.visibility_timeout,
+                MessageAttributeNames=["All"],
+            )
+            received = monotonic()
+            messages = response.get("Messages", [])
+            if not messages:
+                return
+
+            for message in messages:
+                self._handle(message, received)
+
+    def run(self, max_messages: int = None) -> dict:
+        """
+        Drain the dead letter queue until it is empty, the SES budget is spent,
+        or max_messages have been handled
+
+        Args:
+            max_messages (int, optional): upper bound on the messages to handle
+
+        Returns:
+            dict: the count of messages per RedriveOutcome and the achieved rate
+        """
+        self._limit = max_messages
+        started = monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            workers = [executor.submit(self._worker) for _ in range(self.max_workers)]
+            for worker in workers:
+                worker.result()
+
+        elapsed = monotonic() - started
+        handled = sum(
+            self._summary[outcome.value]
+            for outcome in RedriveOutcome
+            if outcome != RedriveOutcome.DEFERRED
+        )
+
+        summary = {
+            outcome.value: self._summary[outcome.value] for outcome in RedriveOutcome
+        }
+        summary["mode"] = self.mode.value
+        summary["elapsed_seconds"] = round(elapsed, 2)
+        summary["messages_per_second"] = round(handled / elapsed, 2) if elapsed else 0.0
+
+        LOGGER.info(f"Redrive complete {summary}")
+        return summary
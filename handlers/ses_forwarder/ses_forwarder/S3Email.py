@@ -2,8 +2,10 @@ import email
 import os
 import string
 from email.mime.application import MIMEApplication
+from email.mime.message import MIMEMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import List
 
 import boto3
 
@@ -20,9 +22,17 @@ class S3Email:
         forward_to (List[str]): The email address to forward the email to
     """
 
-    def __init__(self, bucket_name: str, key: str, region: str = "us-east-1"):
-        self.s3_client = boto3.client("s3")
-        self.ses_client = boto3.client("ses", region)
+    def __init__(
+        self,
+        bucket_name: str,
+        key: str,
+        region: str = "us-east-1",
+        s3_client=None,
+        ses_client=None,
+    ):
+        # clients may be shared between emails to reuse their connections
+        self.s3_client = s3_client or boto3.client("s3")
+        self.ses_client = ses_client or boto3.client("ses", region)
         s3_object = self.s3_client.get_object(Bucket=bucket_name, Key=key)
         self.email = email.message_from_string(s3_object["Body"].read().decode("utf-8"))
 
@@ -90,3 +100,53 @@ class S3Email:
         )
 
         return response
+
+    @staticmethod
+    def build_digest(emails: List["S3Email"]) -> MIMEMultipart:
+        """
+        Combine the given emails into a multipart/digest message, with a summary
+        part followed by each email as a message/rfc822 part. All emails are
+        expected to share the same forward_to destinations
+
+        Args:
+            emails (List[S3Email]): the emails to combine into the digest
+        """
+        first = emails[0]
+
+        digest = MIMEMultipart("digest")
+        digest.add_header("Subject", f"Digest of {len(emails)} messages")
+        digest.add_header("From", first.forward_from)
+        for dest in first.forward_to:
+            digest.add_header("To", dest)
+
+        digest.attach(
+            MIMEText(
+                "\n".join(
+                    f"{s3_email.orig_from} to {s3_email.orig_to}" for s3_email in emails
+                )
+            )
+        )
+        for s3_email in emails:
+            s3_email.email.add_header("Reply-To", s3_email.orig_from)
+            digest.attach(MIMEMessage(s3_email.email))
+
+        return digest
+
+    @staticmethod
+    def send_digest(emails: List["S3Email"]):
+        """
+        Send the given emails as a single digest message
+
+        Args:
+            emails (List[S3Email]): the emails to combine into the digest
+        """
+        first = emails[0]
+        digest = S3Email.build_digest(emails)
+
+        response = first.ses_client.send_raw_email(
+            Source=first.forward_from,
+            Destinations=first.forward_to,
+            RawMessage={"Data": digest.as_string()},
+        )
+
+        return response
@@ -6,6 +6,7 @@ class LookupKey(Enum):
     ITEM = "Item"
     HASH_KEY = "email#domain"
     RANGE_KEY = "destination"
+    DIGEST = "digest"
 
 
 class DedupeKey(Enum):
@@ -19,3 +20,47 @@ class DedupeKey(Enum):
 class Status(Enum):
     COMPLETE = "COMPLETE"
     IN_PROGRESS = "IN_PROGRESS"
+
+
+class RedriveKey(Enum):
+    ORIGINAL_MESSAGE_ID = "original_message_id"
+
+
+class RedriveMode(Enum):
+    PROCESS = "process"
+    MOVE = "move"
+
+
+class RedriveOutcome(Enum):
+    SENT = "sent"
+    MOVED = "moved"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+    DEFERRED = "deferred"
+
+
+class GuardCounter(Enum):
+    HEDGES_FIRED = "hedges_fired"
+    BREAKER_TRIPS = "breaker_trips"
+    DEADLINES_EXCEEDED = "deadlines_exceeded"
+    FALLBACKS = "fallbacks"
+
+
+def get_dedupe_id(record: dict) -> str:
+    """
+    Return the message ID used to dedupe the given SQS record. Records redriven
+    from the dead letter queue carry the ID of the original message so that the
+    existing DynamoDB item is reused rather than a new one being created
+
+    Args:
+        record (dict): the SQS record, shaped like the ones Lambda receives
+
+    Returns:
+        str: the message ID to use as the dedupe table hash key
+    """
+    attributes = record.get("messageAttributes") or {}
+    original = attributes.get(RedriveKey.ORIGINAL_MESSAGE_ID.value)
+    if original:
+        return original["stringValue"]
+
+    return record["messageId"]
@@ -0,0 +1,189 @@
+from time import sleep
+
+import pytest
+from botocore.exceptions import ClientError
+from ses_forwarder.ses_forwarder.DynamoDBGuard import (
+    CircuitOpenError,
+    DeadlineExceededError,
+    DynamoDBGuard,
+)
+from ses_forwarder.ses_forwarder.LookupDestination import LookupDestination
+
+
+def throttling_error():
+    return ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException"}}, "Query"
+    )
+
+
+def throttle():
+    raise throttling_error()
+
+
+class StubClient:
+    """
+    Client whose query returns the given responses in order, raising any that
+    are exceptions
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def query(self, **kwargs):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+
+def test_hedged_read():
+    """
+    Ensure a slow read fires a hedged duplicate request
+    """
+    guard = DynamoDBGuard(deadline=1, hedge_delay=0.05)
+    response = guard.read(lambda: sleep(0.2))
+
+    assert response is None and guard.metrics()["hedges_fired"] == 1
+
+
+def test_no_hedge_while_failing():
+    """
+    Ensure no hedge is sent while throttling failures are accumulating
+    """
+    guard = DynamoDBGuard(deadline=1, hedge_delay=0.05)
+    with pytest.raises(ClientError):
+        guard.read(throttle)
+
+    guard.read(lambda: sleep(0.2))
+
+    assert guard.metrics()["hedges_fired"] == 0
+
+
+def test_read_deadline():
+    """
+    Ensure a read that outlives the deadline raises instead of blocking
+    """
+    guard = DynamoDBGuard(deadline=0.1, hedge_delay=0.05)
+    with pytest.raises(DeadlineExceededError):
+        guard.read(lambda: sleep(1))
+
+    assert guard.metrics()["deadlines_exceeded"] == 1
+
+
+def test_circuit_breaker():
+    """
+    Ensure repeated throttling opens the breaker and later calls fail fast
+    """
+    guard = DynamoDBGuard(failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            guard.read(throttle)
+
+    with pytest.raises(CircuitOpenError):
+        guard.read(throttle)
+
+    assert guard.metrics()["breaker_trips"] == 1
+
+
+def test_write_bypass_breaker():
+    """
+    Ensure writes that must not be dropped are attempted while the breaker is open
+    """
+    guard = DynamoDBGuard(failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ClientError):
+        guard.read(throttle)
+
+    with pytest.raises(CircuitOpenError):
+        guard.write(lambda: "written")
+
+    assert guard.write(lambda: "written", bypass_breaker=True) == "written"
+
+
+def test_lookup_fallback(monkeypatch):
+    """
+    Ensure a cached route is served while the lookup table throttles or the
+    breaker is open, and that routes never seen still raise
+    """
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    items = [{"email#domain": "test#pieceofprivacy.com"}]
+    guard = DynamoDBGuard(failure_threshold=2, reset_timeout=60)
+    lookup_email = LookupDestination("table", "email#domain", "destination", guard)
+    client = StubClient({"Items": items}, throttling_error(), throttling_error())
+    monkeypatch.setattr(guard, "client", lambda write=False: client)
+
+    assert lookup_email.lookup_destination("test#pieceofprivacy.com") == items
+
+    # throttled, then the breaker opens
+    assert lookup_email.lookup_destination("test#pieceofprivacy.com") == items
+    assert lookup_email.lookup_destination("test#pieceofprivacy.com") == items
+    assert lookup_email.lookup_destination("test#pieceofprivacy.com") == items
+
+    with pytest.raises(CircuitOpenError):
+        lookup_email.lookup_destination("other#pieceofprivacy.com")
+
+    assert guard.metrics()["fallbacks"] == 3
+    assert guard.metrics()["breaker_trips"] == 1
+
+
+def test_lookup_cache_bounds(monkeypatch):
+    """
+    Ensure the route cache evicts the least recently used routes and stops
+    serving routes older than the cache ttl
+    """
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    items = [{"email#domain": "test#pieceofprivacy.com"}]
+    guard = DynamoDBGuard(failure_threshold=10, reset_timeout=60)
+    lookup_email = LookupDestination(
+        "table", "email#domain", "destination", guard, cache_size=2, cache_ttl=0.1
+    )
+    client = StubClient(
+        {"Items": items},
+        {"Items": []},
+        {"Items": []},
+        throttling_error(),
+        throttling_error(),
+    )
+    monkeypatch.setattr(guard, "client", lambda write=False: client)
+
+    lookup_email.lookup_destination("test#pieceofprivacy.com")
+    lookup_email.lookup_destination("random1#pieceofprivacy.com")
+    lookup_email.lookup_destination("random2#pieceofprivacy.com")
+
+    # evicted as the least recently used route
+    with pytest.raises(ClientError):
+        lookup_email.lookup_destination("test#pieceofprivacy.com")
+
+    sleep(0.2)
+
+    # expired
+    with pytest.raises(ClientError):
+        lookup_email.lookup_destination("random2#pieceofprivacy.com")
+
+    assert len(lookup_email._routes) == 1
+    assert guard.metrics()["fallbacks"] == 0
+
+
+def test_write_deadline():
+    """
+    Ensure a write whose retries outlive the write deadline raises instead of
+    blocking, and counts towards the breaker
+    """
+    guard = DynamoDBGuard(write_deadline=0.1, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(DeadlineExceededError):
+        guard.write(lambda: sleep(1))
+
+    with pytest.raises(CircuitOpenError):
+        guard.write(lambda: "written")
+
+    assert guard.metrics()["deadlines_exceeded"] == 1
+
+
+def test_write_config():
+    """
+    Ensure writes get a bounded number of attempts rather than botocore's
+    default DynamoDB retries
+    """
+    config = DynamoDBGuard().config(write=True)
+
+    assert config.retries == {"max_attempts": 3, "mode": "standard"}
@@ -1,8 +1,10 @@
+import io
 import json
 import uuid
 
 import boto3
 import pytest
+from ses_forwarder.ses_forwarder.S3Email import S3Email
 
 
 def test_send_email(s3_email, monkeypatch):
@@ -14,3 +16,42 @@ def test_send_email(s3_email, monkeypatch):
 
     response = s3_email.send_email()
     assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+
+class StubS3Client:
+    def get_object(self, Bucket, Key):
+        with open("handlers/tests/events/test_email.txt", "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+
+def test_build_digest(monkeypatch):
+    """
+    Ensure the digest holds a summary followed by every email as its own part
+    """
+    monkeypatch.setenv("MAIL_SENDER", "from@pieceofprivacy.com")
+    emails = [
+        S3Email("bucket", key, s3_client=StubS3Client(), ses_client=object())
+        for key in ["first", "second"]
+    ]
+    for s3_email in emails:
+        s3_email.add_forward_to("to@pieceofprivacy.com")
+
+    digest = S3Email.build_digest(emails)
+    parts = digest.get_payload()
+
+    assert digest.get_content_type() == "multipart/digest"
+    assert digest["To"] == "to@pieceofprivacy.com"
+    assert len(parts) == 3 and parts[0].get_content_type() == "text/plain"
+    assert all(part.get_content_type() == "message/rfc822" for part in parts[1:])
+    assert parts[1].get_payload(0)["Reply-To"] == emails[0].orig_from
+
+
+def test_send_digest(s3_email, monkeypatch):
+    """
+    Ensure that several emails can be forwarded as a single digest
+    """
+    monkeypatch.setenv("MAIL_SENDER", "from@pieceofprivacy.com")
+    s3_email.add_forward_to("to@pieceofprivacy.com")
+
+    response = S3Email.send_digest([s3_email])
+    assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
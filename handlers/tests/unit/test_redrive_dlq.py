@@ -0,0 +1,159 @@
+import json
+import uuid
+from time import monotonic
+
+import boto3
+import pytest
+from ses_forwarder.ses_forwarder.RedriveDLQ import RateLimiter, RedriveDLQ
+from ses_forwarder.ses_forwarder.utils import RedriveMode
+
+
+@pytest.fixture()
+def dlq_queue(sqs_client):
+    queue_name = f"pytest-{uuid.uuid4().hex}"
+    response = sqs_client.create_queue(QueueName=queue_name)
+    yield response["QueueUrl"]
+    sqs_client.delete_queue(QueueUrl=response["QueueUrl"])
+
+
+def test_rate_limiter():
+    """
+    Ensure the rate limiter holds callers to the configured rate
+    """
+    limiter = RateLimiter(20, capacity=1)
+
+    started = monotonic()
+    for _ in range(11):
+        limiter.acquire()
+
+    assert monotonic() - started >= 0.5
+
+
+def test_invalid_rate_limiter():
+    """
+    Ensure a rate limiter can't be created without a positive rate
+    """
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_redrive_move(sqs_client, sqs_queue, dlq_queue, dedupe_sqs):
+    """
+    Ensure messages are moved back to the main queue carrying their original
+    message ID, and that messages already marked COMPLETE are dropped
+    """
+    sent = sqs_client.send_message(QueueUrl=dlq_queue, MessageBody="pending message")
+    complete = sqs_client.send_message(
+        QueueUrl=dlq_queue, MessageBody="complete message"
+    )
+    item = dedupe_sqs.create_item(complete["MessageId"])
+    item["status"] = "COMPLETE"
+    dedupe_sqs.update_item(item)
+
+    redrive = RedriveDLQ(
+        dlq_queue.split("/")[-1],
+        None,
+        dedupe_sqs,
+        mode=RedriveMode.MOVE,
+        queue_name=sqs_queue.split("/")[-1],
+        max_workers=2,
+    )
+    summary = redrive.run()
+
+    assert summary["moved"] == 1 and summary["skipped"] == 1
+
+    queue_message = sqs_client.receive_message(
+        QueueUrl=sqs_queue, MessageAttributeNames=["All"]
+    )
+    attributes = queue_message["Messages"][0]["MessageAttributes"]
+    assert attributes["original_message_id"]["StringValue"] == sent["MessageId"]
+
+
+def test_redrive_process(
+    monkeypatch,
+    s3_client,
+    bucket,
+    sqs_client,
+    dlq_queue,
+    dedupe_sqs,
+    lookup_email,
+):
+    """
+    Ensure process mode sends pending messages through process_record, deletes
+    them from the dead letter queue, and skips messages already marked COMPLETE
+    """
+    # the handler needs its environment, so only import it where it is used
+    import ses_forwarder.main as handler
+
+    monkeypatch.setenv("LAMBDA_TIMEOUT", "60")
+    monkeypatch.setenv("MAIL_SENDER", "from@pieceofprivacy.com")
+    monkeypatch.setattr(handler, "DedupeSQS", dedupe_sqs)
+    monkeypatch.setattr(handler, "LookupDestination", lookup_email)
+
+    lookup_email.add_destination(
+        {
+            "email#domain": "test#pieceofprivacy.com",
+            "destination": "to@pieceofprivacy.com",
+        }
+    )
+
+    key = f"pytest-{uuid.uuid4().hex}"
+    with open("handlers/tests/events/test_email.txt", "rb") as f:
+        s3_client.put_object(Body=f, Bucket=bucket, Key=key)
+
+    message = {"receipt": {"action": {"bucketName": bucket, "objectKey": key}}}
+    body = json.dumps({"Message": json.dumps(message)})
+
+    sent = sqs_client.send_message(QueueUrl=dlq_queue, MessageBody=body)
+    complete = sqs_client.send_message(QueueUrl=dlq_queue, MessageBody=body)
+    item = dedupe_sqs.create_item(complete["MessageId"])
+    item["status"] = "COMPLETE"
+    dedupe_sqs.update_item(item)
+
+    redrive = RedriveDLQ(
+        dlq_queue.split("/")[-1],
+        handler.process_record,
+        dedupe_sqs,
+        max_workers=2,
+    )
+    summary = redrive.run()
+
+    assert summary["sent"] == 1 and summary["skipped"] == 1
+    assert dedupe_sqs.get_item(sent["MessageId"])["status"] == "COMPLETE"
+
+    queue_attributes = sqs_client.get_queue_attributes(
+        QueueUrl=dlq_queue,
+        AttributeNames=[
+            "ApproximateNumberOfMessages",
+            "ApproximateNumberOfMessagesNotVisible",
+        ],
+    )["Attributes"]
+    assert queue_attributes["ApproximateNumberOfMessages"] == "0"
+    assert queue_attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_redrive_failed_once(sqs_client, dlq_queue, dedupe_sqs):
+    """
+    Ensure a failing message received again during the drain is counted once
+    and left in the dead letter queue
+    """
+    sqs_client.send_message(QueueUrl=dlq_queue, MessageBody="failing message")
+
+    def process_record(record):
+        raise ValueError("unable to process record")
+
+    redrive = RedriveDLQ(
+        dlq_queue.split("/")[-1],
+        process_record,
+        dedupe_sqs,
+        max_workers=1,
+    )
+    message = sqs_client.receive_message(
+        QueueUrl=dlq_queue, MessageAttributeNames=["All"]
+    )["Messages"][0]
+
+    # the same message reappearing after its visibility timeout
+    for _ in range(2):
+        redrive._handle(message, monotonic())
+
+    assert redrive.run()["failed"] == 1
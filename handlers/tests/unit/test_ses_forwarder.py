@@ -80,4 +80,230 @@ def test_handler(
     }
 
     response = handler.handler(event, None)
-    assert response is None
+    assert response == {"batchItemFailures": []}
+
+
+def coalesce_event(s3_client, bucket, sqs_client, sqs_queue, count):
+    """
+    Build an SQS event holding count records, each pointing at its own copy of
+    the example email
+    """
+    queue_attributes = sqs_client.get_queue_attributes(
+        QueueUrl=sqs_queue, AttributeNames=["QueueArn"]
+    )
+    queue_arn = queue_attributes["Attributes"]["QueueArn"]
+
+    records = []
+    for _ in range(count):
+        key = f"pytest-{uuid.uuid4().hex}"
+        with open("handlers/tests/events/test_email.txt", "rb") as f:
+            s3_client.put_object(Body=f, Bucket=bucket, Key=key)
+
+        message = {"receipt": {"action": {"bucketName": bucket, "objectKey": key}}}
+        sqs_client.send_message(QueueUrl=sqs_queue, MessageBody="example message")
+        queue_message = sqs_client.receive_message(QueueUrl=sqs_queue)["Messages"][0]
+
+        records.append(
+            {
+                "messageId": queue_message["MessageId"],
+                "receiptHandle": queue_message["ReceiptHandle"],
+                "eventSourceARN": queue_arn,
+                "body": json.dumps({"Message": json.dumps(message)}),
+            }
+        )
+
+    return {"Records": records}
+
+
+@pytest.mark.parametrize("digest", [False, True])
+def test_handler_coalesce(
+    monkeypatch,
+    s3_client,
+    bucket,
+    sqs_client,
+    sqs_queue,
+    dedupe_sqs,
+    lookup_email,
+    digest,
+):
+    """
+    Ensure a coalesced batch looks up the recipient and checks the quota once,
+    and that a digest domain receives a single email
+    """
+    monkeypatch.setenv("LAMBDA_TIMEOUT", "60")
+    monkeypatch.setenv("MAIL_SENDER", "from@pieceofprivacy.com")
+    monkeypatch.setattr(handler, "COALESCE_SENDS", True)
+    monkeypatch.setattr(handler, "DedupeSQS", dedupe_sqs)
+    monkeypatch.setattr(handler, "LookupDestination", lookup_email)
+
+    item = {
+        "email#domain": "test#pieceofprivacy.com",
+        "destination": "to@pieceofprivacy.com",
+    }
+    if digest:
+        item["digest"] = True
+    lookup_email.add_destination(item)
+
+    calls = {"lookup": 0, "quota": [], "send": 0}
+
+    lookup_destination = lookup_email.lookup_destination
+    check_send_quota = handler.check_send_quota
+    send_raw_email = handler.SES_CLIENT.send_raw_email
+
+    def count_lookup(*args, **kwargs):
+        calls["lookup"] += 1
+        return lookup_destination(*args, **kwargs)
+
+    def count_quota(count):
+        calls["quota"].append(count)
+        return check_send_quota(count)
+
+    def count_send(*args, **kwargs):
+        calls["send"] += 1
+        return send_raw_email(*args, **kwargs)
+
+    monkeypatch.setattr(lookup_email, "lookup_destination", count_lookup)
+    monkeypatch.setattr(handler, "check_send_quota", count_quota)
+    monkeypatch.setattr(handler.SES_CLIENT, "send_raw_email", count_send)
+
+    event = coalesce_event(s3_client, bucket, sqs_client, sqs_queue, 2)
+    response = handler.handler(event, None)
+
+    assert response == {"batchItemFailures": []}
+    assert calls["lookup"] == 1
+    assert calls["quota"] == ([1] if digest else [2])
+    assert calls["send"] == (1 if digest else 2)
+    for record in event["Records"]:
+        assert dedupe_sqs.get_item(record["messageId"])["status"] == "COMPLETE"
+
+
+def test_handler_coalesce_failure(
+    monkeypatch,
+    s3_client,
+    bucket,
+    sqs_client,
+    sqs_queue,
+    dedupe_sqs,
+    lookup_email,
+):
+    """
+    Ensure a record that can't be processed is reported on its own without
+    failing the rest of the batch
+    """
+    monkeypatch.setenv("LAMBDA_TIMEOUT", "60")
+    monkeypatch.setenv("MAIL_SENDER", "from@pieceofprivacy.com")
+    monkeypatch.setattr(handler, "COALESCE_SENDS", True)
+    monkeypatch.setattr(handler, "DedupeSQS", dedupe_sqs)
+    monkeypatch.setattr(handler, "LookupDestination", lookup_email)
+
+    lookup_email.add_destination(
+        {
+            "email#domain": "test#pieceofprivacy.com",
+            "destination": "to@pieceofprivacy.com",
+        }
+    )
+
+    event = coalesce_event(s3_client, bucket, sqs_client, sqs_queue, 2)
+    broken = json.loads(json.loads(event["Records"][1]["body"])["Message"])
+    broken["receipt"]["action"]["objectKey"] = "missing"
+    event["Records"][1]["body"] = json.dumps({"Message": json.dumps(broken)})
+
+    response = handler.handler(event, None)
+
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": event["Records"][1]["messageId"]}]
+    }
+    assert dedupe_sqs.get_item(event["Records"][0]["messageId"])["status"] == "COMPLETE"
+
+
+class StubEmail:
+    """
+    Email addressed to its object key, which is sent without touching S3 or SES
+    """
+
+    def __init__(self, bucket_name, key, s3_client=None, ses_client=None):
+        self.orig_to = key
+        self.forward_to = []
+
+    def add_forward_to(self, destination):
+        self.forward_to.append(destination)
+
+    def send_email(self):
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def test_coalesce_records_quota_once(monkeypatch):
+    """
+    Ensure a batch of distinct recipients checks the quota once for all of its
+    sends rather than once per group
+    """
+    quota = []
+    completed = []
+
+    monkeypatch.setattr(handler, "S3Email", StubEmail)
+    monkeypatch.setattr(
+        handler, "claim_record", lambda record: {"message_id": record["messageId"]}
+    )
+    monkeypatch.setattr(
+        handler, "lookup_routes", lambda orig_to: [{"destination": f"{orig_to}@to"}]
+    )
+    monkeypatch.setattr(handler, "check_send_quota", quota.append)
+    monkeypatch.setattr(
+        handler,
+        "complete_record",
+        lambda record, item, response: completed.append(record["messageId"]),
+    )
+
+    records = []
+    for orig_to in ["first", "second", "third"]:
+        message = {
+            "receipt": {"action": {"bucketName": "bucket", "objectKey": orig_to}}
+        }
+        records.append(
+            {"messageId": orig_to, "body": json.dumps({"Message": json.dumps(message)})}
+        )
+
+    assert handler.coalesce_records(records) == []
+    assert quota == [3]
+    assert completed == ["first", "second", "third"]
+
+
+class FailingDedupe:
+    """
+    Dedupe table whose writes always miss their deadline
+    """
+
+    def __init__(self):
+        self.bypass_breaker = []
+
+    def update_item(self, item, condition_expression=None, bypass_breaker=False):
+        self.bypass_breaker.append(bypass_breaker)
+        raise handler.DeadlineExceededError("DynamoDB write did not complete")
+
+
+def test_update_sqs_dynamodb_guard_errors(monkeypatch):
+    """
+    Ensure the COMPLETE write bypasses the breaker and a failure is swallowed so
+    the sent email is deleted rather than resent, while a failed IN_PROGRESS
+    claim still stops processing
+    """
+    monkeypatch.setenv("LAMBDA_TIMEOUT", "60")
+    dedupe = FailingDedupe()
+    monkeypatch.setattr(handler, "DedupeSQS", dedupe)
+
+    item = {"message_id": "test", "consumption_count": 1, "status": "IN_PROGRESS"}
+    handler.update_sqs_dynamodb(item, handler.Status.COMPLETE)
+
+    with pytest.raises(handler.ProcessingError):
+        handler.update_sqs_dynamodb(item, handler.Status.IN_PROGRESS)
+
+    assert dedupe.bypass_breaker == [True, False]
+
+
+@pytest.mark.parametrize("option", ["--workers", "--rate", "--ses-share"])
+def test_parse_args_rejects_non_positive(option):
+    """
+    Ensure the redrive command rejects settings that would stall or crash the drain
+    """
+    with pytest.raises(SystemExit):
+        handler.parse_args(["redrive", "--dlq", "dlq", option, "0"])
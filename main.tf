@@ -193,6 +193,7 @@ module "lambda" {
       REGION         = data.aws_region.current.name
       DEDUPE_TABLE   = aws_dynamodb_table.dedupe_table.id
       LOOKUP_TABLE   = aws_dynamodb_table.lookup_table.id
+      COALESCE_SENDS = tostring(var.coalesce_sends)
     }
   }
 }
@@ -209,8 +210,9 @@ resource "aws_lambda_permission" "this" {
 resource "aws_lambda_event_source_mapping" "this" {
   event_source_arn                   = aws_sqs_queue.this.arn
   function_name                      = module.lambda.function_arn
-  batch_size                         = 1 #change this to 10 later
-  maximum_batching_window_in_seconds = 0 # change this to 60 later
+  batch_size                         = var.batch_size
+  maximum_batching_window_in_seconds = var.batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
 }
 
 data "aws_iam_policy_document" "lambda_ses_forwarder" {
@@ -238,6 +240,18 @@ data "aws_iam_policy_document" "lambda_ses_forwarder" {
     ]
   }
 
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "ses:GetSendQuota",
+    ]
+
+    resources = [
+      "*",
+    ]
+  }
+
   statement {
     effect = "Allow"
 
@@ -32,6 +32,24 @@ variable "mail_sender" {
   type        = string
 }
 
+variable "batch_size" {
+  description = "The maximum number of SQS records passed to the lambda per invocation"
+  type        = number
+  default     = 1
+}
+
+variable "batching_window" {
+  description = "The maximum number of seconds SQS records are gathered before invoking the lambda"
+  type        = number
+  default     = 0
+}
+
+variable "coalesce_sends" {
+  description = "Group the records of a batch by destination to share lookups, connections, and quota checks"
+  type        = bool
+  default     = false
+}
+
 variable "tags" {
   description = "The tags applied to the bucket"
   type        = map(string)